@@ -0,0 +1,61 @@
+"""
+Stand-in grader worker for RemoteGrader, grading the received jobs with the local epicbox grader
+"""
+import base64
+import json
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from nand2tetris.graders import EpicboxGrader
+
+log = logging.getLogger(__name__)
+
+
+class GradeRequestHandler(BaseHTTPRequestHandler):
+    """
+    Handles POST /grade with a JSON body {"jobs": [{"content": <base64 zip>, "project": "01"}, ...]},
+    answering {"results": [{"stdout": ..., "stderr": ...}, ...]}.
+    """
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        if self.path != '/grade':
+            self.send_error(404)
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            jobs = [
+                {"content": base64.b64decode(job['content']), "project": job['project']}
+                for job in body['jobs']
+            ]
+        except (TypeError, ValueError, KeyError):
+            self.send_error(400)
+            return
+        try:
+            results = self.server.grader.grade(jobs)
+        except Exception:  # pylint: disable=broad-except
+            # docker and epicbox failures must still get a response, RemoteGrader retries on 503
+            log.exception("Failed to grade %d jobs", len(jobs))
+            self.send_error(503)
+            return
+        response = json.dumps({"results": results}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        log.info(format, *args)
+
+
+def serve(host='127.0.0.1', port=8099, grader=None):
+    """
+    Runs a grader worker until interrupted.
+    """
+    server = ThreadingHTTPServer((host, port), GradeRequestHandler)
+    server.grader = grader or EpicboxGrader()
+    log.info("Grader worker listening on %s:%d", host, port)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
@@ -0,0 +1,181 @@
+"""
+Grader backends running the nand2tetris autograder on submission zip files
+"""
+import base64
+import logging
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import epicbox
+import requests
+from django.conf import settings
+from django.utils.module_loading import import_string
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+log = logging.getLogger(__name__)
+
+EPICBOX_PROFILE = 'nand2tetris'
+EPICBOX_LIMITS = {'cputime': 5, 'memory': 128}
+
+epicbox.configure(
+    profiles=[
+        epicbox.Profile(EPICBOX_PROFILE, 'tcarreira/nand2tetris-autograder:2.6-epicbox')
+    ]
+)
+
+_grader = None
+
+
+class GraderError(Exception):
+    """
+    Raised when a grader backend can not grade a batch of jobs.
+    """
+
+
+class GraderBackend(object):
+    """
+    Base class for grader backends.
+    A job is a dict with the submission zip file "content" (bytes) and the "project" number.
+    """
+
+    def grade(self, jobs):
+        """
+        Grades a batch of jobs, returns a list of dicts with the grader "stdout" and "stderr",
+        in the same order as the jobs.
+        """
+        raise NotImplementedError
+
+
+class EpicboxGrader(GraderBackend):
+    """
+    Runs the autograder in a local docker container with epicbox.
+    """
+
+    def __init__(self, limits=None):
+        self.limits = limits or EPICBOX_LIMITS
+
+    def grade(self, jobs):
+        return [self.grade_job(job) for job in jobs]
+
+    def grade_job(self, job):
+        files = [{'name': 'submissao.zip', 'content': job['content']}]
+        result = epicbox.run(EPICBOX_PROFILE, job['project'] + ".test", files=files,
+                             limits=self.limits)
+        output = result["stdout"]
+        stderr = result["stderr"]
+        try:
+            output = output.decode('utf-8')
+            stderr = stderr.decode('utf-8')
+        except (UnicodeDecodeError, AttributeError):
+            pass
+        return {"stdout": output, "stderr": stderr}
+
+
+class RemoteGrader(GraderBackend):
+    """
+    Sends jobs to a pool of grader workers over HTTP, see nand2tetris.grader_server.
+    Each batch is sharded between the workers with the fewest jobs in flight from this process,
+    ties are broken round-robin from a random starting worker so that processes grading one job
+    at a time still spread their jobs over the pool.
+    """
+
+    def __init__(self, workers, timeout=120, retries=3, pool_size=10):
+        if not workers:
+            raise ValueError("RemoteGrader needs at least one worker url")
+        self.workers = [worker.rstrip('/') for worker in workers]
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=len(self.workers),
+            pool_maxsize=pool_size,
+            max_retries=Retry(
+                total=retries,
+                backoff_factor=0.5,
+                status_forcelist=(502, 503, 504),
+                # grading is idempotent
+                allowed_methods=frozenset(['POST'])
+            )
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.in_flight = {worker: 0 for worker in self.workers}
+        self.next_worker = random.randrange(len(self.workers))
+        self.lock = threading.Lock()
+
+    def grade(self, jobs):
+        shards = {}
+        with self.lock:
+            for index, job in enumerate(jobs):
+                worker = self.choose_worker()
+                self.in_flight[worker] += 1
+                shards.setdefault(worker, []).append((index, job))
+
+        results = [None] * len(jobs)
+        with ThreadPoolExecutor(max_workers=len(shards) or 1) as executor:
+            for shard, shard_results in zip(
+                    shards.values(), executor.map(self.grade_shard, shards.keys(), shards.values())
+            ):
+                for (index, _), result in zip(shard, shard_results):
+                    results[index] = result
+        return results
+
+    def choose_worker(self):
+        """
+        Returns the worker with the fewest jobs in flight, the next one in round-robin order on ties.
+        Must be called with the lock held.
+        """
+        count = len(self.workers)
+        candidates = [self.workers[(self.next_worker + offset) % count] for offset in range(count)]
+        worker = min(candidates, key=lambda w: self.in_flight[w])
+        self.next_worker = (self.workers.index(worker) + 1) % count
+        return worker
+
+    def grade_shard(self, worker, shard):
+        try:
+            response = self.session.post(
+                worker + '/grade',
+                json={
+                    "jobs": [
+                        {
+                            "content": base64.b64encode(job['content']).decode('ascii'),
+                            "project": job['project'],
+                        }
+                        for _, job in shard
+                    ]
+                },
+                timeout=self.timeout
+            )
+            response.raise_for_status()
+            results = response.json()["results"]
+        except (requests.RequestException, ValueError, KeyError) as error:
+            log.exception("Grader worker %s failed to grade %d jobs", worker, len(shard))
+            raise GraderError(str(error))
+        finally:
+            with self.lock:
+                self.in_flight[worker] -= len(shard)
+        if len(results) != len(shard):
+            raise GraderError("Grader worker {} returned {} results for {} jobs".format(
+                worker, len(results), len(shard)
+            ))
+        return results
+
+
+def get_grader():
+    """
+    Returns the grader backend configured in the NAND2TETRIS_GRADER setting, eg:
+
+        NAND2TETRIS_GRADER = {
+            "BACKEND": "nand2tetris.graders.RemoteGrader",
+            "OPTIONS": {"workers": ["http://grader1:8099", "http://grader2:8099"]},
+        }
+
+    The local epicbox grader is used by default.
+    """
+    global _grader  # pylint: disable=global-statement
+    if _grader is None:
+        config = getattr(settings, "NAND2TETRIS_GRADER", {})
+        backend = import_string(config.get("BACKEND", "nand2tetris.graders.EpicboxGrader"))
+        _grader = backend(**config.get("OPTIONS", {}))
+    return _grader
@@ -0,0 +1,28 @@
+"""
+Evicts old submission archives and deletes submission files no submission references.
+"""
+from django.core.management.base import BaseCommand
+
+from nand2tetris.tasks import cleanup_storage
+
+
+class Command(BaseCommand):
+    help = "Evicts old nand2tetris submission archives and deletes orphaned submission files"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help="Only report what would be deleted"
+        )
+
+    def handle(self, *args, **options):
+        report = cleanup_storage(dry_run=options['dry_run'])
+        for path in report['archives']:
+            self.stdout.write("archive: {}".format(path))
+        for path in report['submission_files']:
+            self.stdout.write("submission file: {}".format(path))
+        self.stdout.write("{} {} bytes".format(
+            "Would free" if report['dry_run'] else "Freed",
+            report['freed_bytes']
+        ))
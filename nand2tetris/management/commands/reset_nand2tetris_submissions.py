@@ -0,0 +1,27 @@
+"""
+Clears the nand2tetris submissions, scores and uploaded files of a whole course.
+"""
+from django.core.management.base import BaseCommand
+
+from nand2tetris.tasks import reset_course_submissions
+
+
+class Command(BaseCommand):
+    help = "Clears the nand2tetris submissions, scores and uploaded files of every student in a course"
+
+    def add_arguments(self, parser):
+        parser.add_argument('course_id', help="edx course id, eg course-v1:org+course+run")
+        parser.add_argument(
+            '--async',
+            action='store_true',
+            dest='run_async',
+            help="Queue a celery task instead of running in this process"
+        )
+
+    def handle(self, *args, **options):
+        if options['run_async']:
+            reset_course_submissions.delay(options['course_id'])
+            self.stdout.write("Queued reset of course {}".format(options['course_id']))
+        else:
+            reset_course_submissions(options['course_id'])
+            self.stdout.write("Reset course {}".format(options['course_id']))
@@ -0,0 +1,17 @@
+"""
+Runs a stand-in grader worker for the remote grader backend.
+"""
+from django.core.management.base import BaseCommand
+
+from nand2tetris.grader_server import serve
+
+
+class Command(BaseCommand):
+    help = "Runs a nand2tetris grader worker, grading with the local epicbox grader"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8099)
+
+    def handle(self, *args, **options):
+        serve(options['host'], options['port'])
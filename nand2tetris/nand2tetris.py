@@ -3,33 +3,33 @@ import logging
 import mimetypes
 import os
 
-import epicbox
 import pkg_resources
-import pytz
 import six
-from common.djangoapps.student.models import user_by_anonymous_id
-from contextlib import closing
 from django.conf import settings
 from django.core.exceptions import PermissionDenied
 from django.core.files import File
 from django.core.files.storage import default_storage
-from openedx.core.djangoapps.course_groups.cohorts import get_cohort, is_course_cohorted, get_course_cohorts
+from openedx.core.djangoapps.course_groups.cohorts import is_course_cohorted, get_course_cohorts
 from submissions import api as submissions_api
 from web_fragments.fragment import Fragment
-from zipfile import ZipFile
 from webob.response import Response
 from xblock.completable import CompletableXBlockMixin
 from xblock.core import XBlock
 from xblock.exceptions import JsonHandlerError
-from xblock.fields import Float, Scope, String
+from xblock.fields import Boolean, Float, Scope, String
 from xblock.scorable import ScorableXBlockMixin, Score
 from xblockutils.resources import ResourceLoader
 from xblockutils.studio_editable import StudioEditableXBlockMixin
 from xmodule.contentstore.content import StaticContent
 
-from nand2tetris.utils import (file_contents_iter, get_file_modified_time_utc,
-                               get_file_storage_path, get_sha1)
-from nand2tetris.tasks import (get_zip_file_name, get_zip_file_path,
+from nand2tetris.graders import GraderError, get_grader
+from nand2tetris.utils import (GRADING_POLL_TIMEOUT, PROJECT_CHIPS, SNAPSHOT_RE, UNASSIGNED_COHORT, InvalidSubmission, build_partial_zip,
+                               file_contents_iter, get_cohort_names, get_file_storage_path,
+                               get_hdl_chip_hashes, get_sha1, get_users_by_anonymous_id,
+                               load_result, notify, save_result, validate_submission_zip,
+                               wait_for_notification)
+from nand2tetris.tasks import (ARCHIVE_EMPTY, ARCHIVE_READY, acquire_zip_lock, delete_submission_files,
+                               get_submissions_snapshot, get_zip_file_name, get_zip_file_path,
                                zip_student_submissions)
 
 log = logging.getLogger(__name__)
@@ -37,13 +37,6 @@ loader = ResourceLoader(__name__)
 
 ITEM_TYPE = "nand2tetrisxblock"
 
-epicbox.configure(
-    profiles=[
-        epicbox.Profile('nand2tetris', 'tcarreira/nand2tetris-autograder:2.6-epicbox')
-    ]
-)
-limits = {'cputime': 5, 'memory': 128}
-
 
 def reify(meth):
     """
@@ -74,6 +67,11 @@ class Nand2TetrisXBlock(XBlock, ScorableXBlockMixin, CompletableXBlockMixin, Stu
                      scope=Scope.settings,
                      help="Se definido, corrige apenas estas componentes do Project, separadas por vírgulas (eg: \"DMux4Way,Xor\" do <a href=\"https://github.com/tcarreira/nand2tetris-autograder/blob/master/spec/cases.01\">Project 01</a>)")
 
+    differential_grading = Boolean(display_name="differential_grading",
+                                   default=False,
+                                   scope=Scope.settings,
+                                   help="Se ativo, só as componentes alteradas desde a última submissão do aluno são avaliadas, sendo reaproveitados os restantes resultados")
+
     student_score = Float(display_name="student_score",
                           default=-1,
                           scope=Scope.user_state)
@@ -88,7 +86,7 @@ class Nand2TetrisXBlock(XBlock, ScorableXBlockMixin, CompletableXBlockMixin, Stu
                     scope=Scope.preferences,
                     help="Turma selecionada para visualização de submissões")
 
-    editable_fields = ('display_name', 'project', 'subproject')
+    editable_fields = ('display_name', 'project', 'subproject', 'differential_grading')
     icon_class = 'problem'
     block_type = 'problem'
     has_score = True
@@ -143,6 +141,21 @@ class Nand2TetrisXBlock(XBlock, ScorableXBlockMixin, CompletableXBlockMixin, Stu
             'result': 'success'
         }
 
+    @XBlock.json_handler
+    def grading_status(self, data, _suffix):
+        """
+        Long-polls the grading progress of the student's upload: waits until the status differs
+        from the one the client already has, returns "received", "grading", "done" or "failed".
+        The upload request already holds a worker, so this one only waits briefly.
+        """
+        return {
+            'status': wait_for_notification(
+                self.get_grading_notification_name(),
+                data.get('status'),
+                timeout=GRADING_POLL_TIMEOUT
+            )
+        }
+
     @XBlock.handler
     def upload_assignment(self, request, suffix=''):
         # pylint: disable=unused-argument
@@ -159,72 +172,90 @@ class Nand2TetrisXBlock(XBlock, ScorableXBlockMixin, CompletableXBlockMixin, Stu
                     size=self.student_upload_max_size()
                 )
             )
-        path = self.file_storage_path(sha1, upload.file.name)
-        uploaded_file = File(upload.file)
-        file_data = uploaded_file.open('rb')
-        files = [{'name': 'submissao.zip', 'content': file_data.read()}]
-        result = epicbox.run('nand2tetris', self.project + ".test", files=files,
-                             limits=limits)
-        output = result["stdout"]
-        stderr = result["stderr"]
         try:
-            output = output.decode('utf-8')
-            stderr = stderr.decode('utf-8')
-        except (UnicodeDecodeError, AttributeError):
-            pass
-
+            validate_submission_zip(upload.file, self.get_expected_chips())
+        except InvalidSubmission as error:
+            # JsonHandlerError is only turned into a response by json handlers
+            return Response(json_body={'error': str(error)}, status=400)
+        notification_name = self.get_grading_notification_name()
+        notify(notification_name, "received")
+        # every path ends with a terminal status, so the next upload does not start from a stale one
+        status = "failed"
         try:
-            output = json.loads(output)["tests"]
-        except:
-            output=[]
-
-        # if subproject is defined, convert the comma-separated-values into a list
-        subprojects = [
-            cmpnt.strip() if "/" not in cmpnt else cmpnt.split("/")[1].strip()
-            for cmpnt in str(self.subproject or "").lower().strip().split(",")
-            if cmpnt.strip() != ""
-        ]
+            path = self.file_storage_path(sha1, upload.file.name)
+            uploaded_file = File(upload.file)
+            file_data = uploaded_file.open('rb')
+            file_content = file_data.read()
+            notify(notification_name, "grading")
+            chip_hashes = None
+            reused = []
+            try:
+                if self.differential_grading:
+                    chip_hashes = get_hdl_chip_hashes(file_content)
+                    output, stderr, reused = self.run_differential_grader(file_content, chip_hashes)
+                else:
+                    output, stderr = self.run_grader(file_content)
+            except InvalidSubmission as error:
+                # entries with corrupt data pass validate_submission_zip, which only reads the central directory
+                return Response(json_body={'error': str(error)}, status=400)
+            except GraderError:
+                return Response(
+                    json_body={'error': 'Não foi possível avaliar a submissão. Tenta novamente mais tarde.'},
+                    status=503
+                )
 
-        # refactor output when subproject is defined (consider only subprojects output)
-        try:
-            if subprojects:
-                new_output = []
+            subprojects = self.get_subprojects()
+
+            # refactor output when subproject is defined (consider only subprojects output)
+            try:
+                if subprojects:
+                    new_output = []
+                    for test in output:
+                        if "number" in test and test["number"].lower() in subprojects:
+                            new_output.append(test)
+                    output = new_output
+            except:
+                pass
+
+            score = 0
+            max_score = 0
+            self.student_score = 0.0
+            try:
                 for test in output:
-                    if "number" in test and test["number"].lower() in subprojects:
-                        new_output.append(test)
-                output = new_output
-        except:
-            pass
-
-        score = 0
-        max_score = 0
-        self.student_score = 0.0
-        try:
-            for test in output:
-                score += int(test["score"])
-                max_score += int(test["max_score"])
-            if max_score > 0:
-                self.student_score = score / max_score
-        except:
-            pass
-        self.emit_completion(self.student_score)
-        self._publish_grade(self.get_score(), False)
-
-        answer = {
-            "sha1": sha1,
-            "filename": upload.file.name,
-            "mimetype": mimetypes.guess_type(upload.file.name)[0],
-            "result": json.dumps({"output": output, "stderr": stderr}),
-            "score": json.dumps({"final": int(self.student_score * 100), "score": score, "max_score": max_score})
-        }
-        student_item_dict = self.get_student_item_dict()
-        submissions_api.create_submission(student_item_dict, answer)
-        log.info("Saving file: %s at path: %s for user: %s", upload.file.name, path, user.username)
-        if default_storage.exists(path):
-            # save latest submission
-            default_storage.delete(path)
-        default_storage.save(path, uploaded_file)
-        return Response(json_body=answer)
+                    score += int(test["score"])
+                    max_score += int(test["max_score"])
+                if max_score > 0:
+                    self.student_score = score / max_score
+            except:
+                pass
+            self.emit_completion(self.student_score)
+            self._publish_grade(self.get_score(), False)
+
+            answer = {
+                "sha1": sha1,
+                "filename": upload.file.name,
+                "mimetype": mimetypes.guess_type(upload.file.name)[0],
+                "result_path": save_result(self.location, {"output": output, "stderr": stderr, "reused": reused}),
+                "result_summary": {
+                    "tests": len(output),
+                    "passed": sum(1 for test in output if test_passed(test)),
+                    "stderr": bool(stderr)
+                },
+                "score": json.dumps({"final": int(self.student_score * 100), "score": score, "max_score": max_score})
+            }
+            if chip_hashes is not None:
+                answer["chip_hashes"] = chip_hashes
+            student_item_dict = self.get_student_item_dict()
+            submissions_api.create_submission(student_item_dict, answer)
+            log.info("Saving file: %s at path: %s for user: %s", upload.file.name, path, user.username)
+            if default_storage.exists(path):
+                # save latest submission
+                default_storage.delete(path)
+            default_storage.save(path, uploaded_file)
+            status = "done"
+            return Response(json_body=answer)
+        finally:
+            notify(notification_name, status)
 
     @XBlock.handler
     def download_assignment(self, request, suffix=''):
@@ -257,75 +288,71 @@ class Nand2TetrisXBlock(XBlock, ScorableXBlockMixin, CompletableXBlockMixin, Stu
     def prepare_download_submissions(self, request, suffix=''):  # pylint: disable=unused-argument
         """
         Runs a async task that collects submissions in background and zip them.
+        Archives are shared between staff users, so if an identical archive is already
+        being built no new task is queued.
         """
         # pylint: disable=no-member
         require(self.is_course_staff())
         user = self.get_real_user()
         require(user)
-        zip_file_ready = False
         location = str(self.location)
-
-        if self.is_zip_file_available(user):
+        cohort = self.get_selected_cohort()
+        assignments = self.get_sorted_submissions(cohort)
+        snapshot = get_submissions_snapshot(assignment['submission_id'] for assignment in assignments)
+        if not assignments:
+            # no archive would be created
+            return Response(json_body={
+                "downloadable": False,
+                "empty": True,
+                "snapshot": snapshot
+            })
+        zip_file_path = self.get_archive_path(cohort, snapshot)
+        zip_file_ready = self.get_archive_state(zip_file_path) == ARCHIVE_READY
+
+        if zip_file_ready:
             log.info("Zip file already available for block: %s for instructor: %s", location, user.username)
-            assignments = self.get_sorted_submissions()
-            if assignments:
-                last_assignment_date = assignments[0]['timestamp'].astimezone(pytz.utc)
-                zip_file_path = get_zip_file_path(
-                    user.username,
-                    self.block_course_id,
-                    self.block_id,
-                    self.location
-                )
-                zip_file_time = get_file_modified_time_utc(zip_file_path)
-                log.info(
-                    "Zip file modified time: %s, last zip file time: %s for block: %s for instructor: %s",
-                    last_assignment_date,
-                    zip_file_time,
-                    location,
-                    user.username
-                )
-                # if last zip file is older the last submission then recreate task
-                if zip_file_time >= last_assignment_date:
-                    zip_file_ready = True
-
-                # check if some one reset submission. If yes the recreate zip file
-                assignment_count = len(assignments)
-                if self.count_archive_files(user) != assignment_count:
-                    zip_file_ready = False
-
-        if not zip_file_ready:
-            log.info("Creating new zip file for block: %s for instructor: %s", location, user.username)
+        elif acquire_zip_lock(zip_file_path):
+            log.info(
+                "Creating new zip file for block: %s for instructor: %s, cohort: %s",
+                location,
+                user.username,
+                cohort
+            )
             zip_student_submissions.delay(
                 self.block_course_id,
                 self.block_id,
                 location,
-                user.username
+                cohort,
+                snapshot
             )
+        else:
+            log.info("Zip file for block: %s is already being created, instructor: %s", location, user.username)
 
         return Response(json_body={
-            "downloadable": zip_file_ready
+            "downloadable": zip_file_ready,
+            "snapshot": snapshot
         })
 
     @XBlock.handler
     def download_submissions(self, request, suffix=''):  # pylint: disable=unused-argument
         """
         Api for downloading zip file which consist of all students submissions.
+        The "snapshot" parameter selects the archive returned by prepare_download_submissions,
+        the latest submissions are used without it.
         """
         # pylint: disable=no-member
         require(self.is_course_staff())
         user = self.get_real_user()
         require(user)
+        cohort = self.get_selected_cohort()
+        snapshot = self.get_requested_snapshot(request, cohort)
         try:
-            zip_file_path = get_zip_file_path(
-                user.username,
-                self.block_course_id,
-                self.block_id,
-                self.location
-            )
+            zip_file_path = self.get_archive_path(cohort, snapshot)
             zip_file_name = get_zip_file_name(
-                user.username,
                 self.block_course_id,
-                self.block_id
+                self.block_id,
+                cohort,
+                snapshot
             )
             return Response(
                 app_iter=file_contents_iter(zip_file_path),
@@ -342,17 +369,89 @@ class Nand2TetrisXBlock(XBlock, ScorableXBlockMixin, CompletableXBlockMixin, Stu
     @XBlock.handler
     def download_submissions_status(self, request, suffix=''):  # pylint: disable=unused-argument
         """
-        returns True if zip file is available for download
+        returns True if zip file is available for download, and whether it will never be because
+        there are no submissions to archive.
+        The "snapshot" parameter selects the archive returned by prepare_download_submissions.
+        With the "wait" parameter, waits for the archive task to signal the zip file is ready
+        instead of returning False right away.
         """
         require(self.is_course_staff())
         user = self.get_real_user()
         require(user)
+        cohort = self.get_selected_cohort()
+        zip_file_path = self.get_archive_path(cohort, self.get_requested_snapshot(request, cohort))
+        state = self.get_archive_state(zip_file_path)
+        if state is None and 'wait' in request.params:
+            state = wait_for_notification(zip_file_path)
         return Response(
             json_body={
-                "zip_available": self.is_zip_file_available(user)
+                "zip_available": state == ARCHIVE_READY,
+                "empty": state == ARCHIVE_EMPTY
             }
         )
 
+    # ----------- Grading -----------
+    def run_grader(self, file_content):
+        """
+        Grades a submission zip file with the configured grader backend.
+        Returns the list of test results and the grader stderr.
+        """
+        result = get_grader().grade([{"content": file_content, "project": self.project}])[0]
+        output = result["stdout"]
+        stderr = result["stderr"]
+
+        try:
+            output = json.loads(output)["tests"]
+        except:
+            output=[]
+        return output, stderr
+
+    def run_differential_grader(self, file_content, chip_hashes):
+        """
+        Grades only the graded chips that changed since the student's last graded submission,
+        reusing the previous results for the others.
+        Returns the list of test results, the grader stderr and the numbers of the reused tests.
+        """
+        previous = self.get_submission()
+        if not chip_hashes or not previous or 'chip_hashes' not in previous['answer']:
+            output, stderr = self.run_grader(file_content)
+            return output, stderr, []
+        previous_hashes = previous['answer']['chip_hashes']
+        # the stored output only has the tests of the graded chips, see get_subprojects
+        previous_tests = {
+            test['number'].lower(): test
+            for test in load_result(previous['answer'])['output']
+            if 'number' in test
+        }
+        graded_chips = set(self.get_expected_chips()) or set(chip_hashes)
+        changed = {
+            chip for chip in graded_chips
+            if chip not in previous_tests or previous_hashes.get(chip) != chip_hashes.get(chip)
+        }
+
+        if not changed:
+            output, stderr = [], ""
+        elif changed <= set(chip_hashes):
+            output, stderr = self.run_grader(build_partial_zip(file_content, changed))
+            if stderr and not output:
+                # the grader failed on the changed chips, which a full run would grade the same way
+                return output, stderr, []
+        else:
+            # a previously graded chip was removed, grade everything
+            output, stderr = self.run_grader(file_content)
+            return output, stderr, []
+
+        reused = []
+        merged = []
+        for test in output:
+            if test.get('number', '').lower() not in previous_tests or test['number'].lower() in changed:
+                merged.append(test)
+        for number, test in previous_tests.items():
+            if number not in changed:
+                reused.append(test['number'])
+                merged.append(test)
+        return merged, stderr, reused
+
     # ----------- Submissions -----------
     def get_student_view_base_data(self, student_id=None):
         data = {
@@ -363,21 +462,27 @@ class Nand2TetrisXBlock(XBlock, ScorableXBlockMixin, CompletableXBlockMixin, Stu
         submission = self.get_submission(student_id)
         if submission:
             data["filename"] = submission['answer']['filename']
-            data["result"] = json.loads(submission['answer']['result'])
+            data["result"] = load_result(submission['answer'])
             data["score"] = json.loads(submission['answer']['score'])
         return data
 
-    def get_sorted_submissions(self):
-        """returns student recent assignments sorted on date"""
+    def get_sorted_submissions(self, cohort=None):
+        """
+        returns student recent assignments sorted on date, optionally restricted to a cohort
+        """
         assignments = []
-        submissions = submissions_api.get_all_submissions(
-            self.block_course_id,
-            self.block_id,
-            ITEM_TYPE
-        )
+        submissions = [
+            submission
+            for submission in submissions_api.get_all_submissions(self.block_course_id, self.block_id, ITEM_TYPE)
+            if submission['answer']
+        ]
+        students = get_users_by_anonymous_id(submission['student_id'] for submission in submissions)
+        course_cohorted = is_course_cohorted(self.course_id)
+        if course_cohorted:
+            cohort_names = get_cohort_names(self.course_id, [student.id for student in students.values()])
 
         for submission in submissions:
-            student = user_by_anonymous_id(submission['student_id'])
+            student = students[submission['student_id']]
             sub = {
                 'submission_id': submission['uuid'],
                 'username': student.username,
@@ -386,11 +491,11 @@ class Nand2TetrisXBlock(XBlock, ScorableXBlockMixin, CompletableXBlockMixin, Stu
                 'timestamp': submission['submitted_at'] or submission['created_at'],
                 'filename': submission['answer']["filename"],
                 'score': json.loads(submission['answer']['score']) if 'score' in submission['answer'] else 0,
-                'result': json.loads(submission['answer']['result'])
             }
-            if is_course_cohorted(self.course_id):
-                group = get_cohort(student, self.course_id, assign=False, use_cached=True)
-                sub['cohort'] = group.name if group else '(não atribuído)'
+            if course_cohorted:
+                sub['cohort'] = cohort_names.get(student.id, UNASSIGNED_COHORT)
+                if cohort and sub['cohort'] != cohort:
+                    continue
             assignments.append(sub)
 
         assignments.sort(
@@ -398,6 +503,35 @@ class Nand2TetrisXBlock(XBlock, ScorableXBlockMixin, CompletableXBlockMixin, Stu
         )
         return assignments
 
+    def get_subprojects(self):
+        """
+        Returns the components to grade when subproject is defined, as a list of lowercase chip names.
+        """
+        # if subproject is defined, convert the comma-separated-values into a list
+        return [
+            cmpnt.strip() if "/" not in cmpnt else cmpnt.split("/")[1].strip()
+            for cmpnt in str(self.subproject or "").lower().strip().split(",")
+            if cmpnt.strip() != ""
+        ]
+
+    def get_expected_chips(self):
+        """
+        Returns the chips a submission is expected to contain, or an empty tuple if unknown
+        (eg projects graded from .asm files).
+        """
+        project_chips = PROJECT_CHIPS.get(self.project, ())
+        subprojects = self.get_subprojects()
+        if subprojects:
+            return tuple(chip for chip in project_chips if chip in subprojects)
+        return project_chips
+
+    def get_grading_notification_name(self):
+        # pylint: disable=no-member
+        """
+        Returns the notification name used to publish the grading progress of the current student.
+        """
+        return "grading.{}.{}".format(self.block_id, self.xmodule_runtime.anonymous_student_id)
+
     def get_student_item_dict(self, student_id=None):
         # pylint: disable=no-member
         """
@@ -447,20 +581,21 @@ class Nand2TetrisXBlock(XBlock, ScorableXBlockMixin, CompletableXBlockMixin, Stu
         used, the block's "clear_student_state" function is called if it exists.
         """
         student_id = kwargs['user_id']
-        for submission in submissions_api.get_submissions(
+        submissions = submissions_api.get_submissions(
             self.get_student_item_dict(student_id)
-        ):
-            submission_file_sha1 = submission['answer'].get('sha1')
-            submission_filename = submission['answer'].get('filename')
-            submission_file_path = self.file_storage_path(submission_file_sha1, submission_filename)
-            if default_storage.exists(submission_file_path):
-                default_storage.delete(submission_file_path)
-            submissions_api.reset_score(
-                student_id,
-                self.block_course_id,
-                self.block_id,
-                clear_state=True
-            )
+        )
+        if not submissions:
+            return
+        submissions_api.reset_score(
+            student_id,
+            self.block_course_id,
+            self.block_id,
+            clear_state=True
+        )
+        delete_submission_files([
+            (self.location, submission['uuid'], submission['answer'])
+            for submission in submissions
+        ])
 
     def get_submission(self, student_id=None):
         """
@@ -510,33 +645,59 @@ class Nand2TetrisXBlock(XBlock, ScorableXBlockMixin, CompletableXBlockMixin, Stu
         """
         return get_file_storage_path(self.location, file_hash, original_filename)
 
-    def is_zip_file_available(self, user):
+    def get_selected_cohort(self):
         """
-        returns True if zip file exists.
+        Returns the cohort selected by the staff user, or None when all submissions should be shown.
         """
-        # pylint: disable=no-member
-        zip_file_path = get_zip_file_path(
-            user.username,
-            self.block_course_id,
-            self.block_id,
-            self.location
+        if self.cohort and is_course_cohorted(self.course_id):
+            return self.cohort
+        return None
+
+    def get_submissions_snapshot(self, cohort=None):
+        """
+        Returns the fingerprint of the latest submissions, optionally restricted to a cohort.
+        """
+        return get_submissions_snapshot(
+            assignment['submission_id'] for assignment in self.get_sorted_submissions(cohort)
         )
-        return default_storage.exists(zip_file_path)
 
-    def count_archive_files(self, user):
+    def get_requested_snapshot(self, request, cohort=None):
+        """
+        Returns the submissions snapshot given in the request parameters, or the current one.
+        """
+        snapshot = request.params.get('snapshot')
+        if snapshot is None:
+            return self.get_submissions_snapshot(cohort)
+        require(SNAPSHOT_RE.match(snapshot))
+        return snapshot
+
+    def get_archive_path(self, cohort=None, snapshot=None):
         """
-        returns number of files archive in zip.
+        Returns the path of the shared submissions zip file for a cohort and submissions snapshot.
         """
         # pylint: disable=no-member
-        zip_file_path = get_zip_file_path(
-            user.username,
+        if snapshot is None:
+            snapshot = self.get_submissions_snapshot(cohort)
+        return get_zip_file_path(
             self.block_course_id,
             self.block_id,
-            self.location
+            self.location,
+            cohort,
+            snapshot
         )
-        with default_storage.open(zip_file_path, 'rb') as zip_file:
-            with closing(ZipFile(zip_file)) as archive:
-                return len(archive.infolist())
+
+    def get_archive_state(self, zip_file_path):
+        """
+        returns ARCHIVE_READY if zip file exists, ARCHIVE_EMPTY if the archive task found no submissions
+        and None otherwise. Archives already signalled as ready are not checked in storage again.
+        """
+        state = wait_for_notification(zip_file_path, timeout=0)
+        if state in (ARCHIVE_READY, ARCHIVE_EMPTY):
+            return state
+        if default_storage.exists(zip_file_path):
+            notify(zip_file_path, ARCHIVE_READY)
+            return ARCHIVE_READY
+        return None
 
     def get_real_user(self):
         """returns session user"""
@@ -584,6 +745,16 @@ def resource_string(path):
     return data.decode("utf8")
 
 
+def test_passed(test):
+    """
+    Returns True if a grader test got full marks, the same rule the templates use.
+    """
+    try:
+        return int(test["score"]) == int(test["max_score"]) and int(test["score"]) > 0
+    except (KeyError, TypeError, ValueError):
+        return False
+
+
 def require(assertion):
     """
     Raises PermissionDenied if assertion is not true.
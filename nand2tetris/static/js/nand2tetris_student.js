@@ -9,7 +9,9 @@ function Nand2TetrisXBlock(runtime, element, context) {
         const prepareDownloadSubmissionsUrl = runtime.handlerUrl(element, 'prepare_download_submissions');
         const downloadSubmissionsStatusUrl = runtime.handlerUrl(element, 'download_submissions_status');
         const loadStudentSubmissionUrl = runtime.handlerUrl(element, 'load_student_submission');
+        const gradingStatusUrl = runtime.handlerUrl(element, 'grading_status');
         const preparingSubmissionsMsg = 'Started preparing student submissions zip file. This may take a while.';
+        const noSubmissionsMsg = 'There are no submissions to download.';
 
         // add download url
         if (context.filename)
@@ -38,14 +40,28 @@ function Nand2TetrisXBlock(runtime, element, context) {
                     });
                 });
 
+            // snapshot of the submissions archive that was reported ready
+            let readySnapshot = null;
+
+            function downloadSubmissions(snapshot) {
+                window.location = downloadSubmissionsUrl + '?' + $.param({snapshot: snapshot});
+            }
+
             $(element).find('#download-init-button_' + id).click(function (e) {
                 e.preventDefault();
                 const self = this;
+                if (readySnapshot) {
+                    downloadSubmissions(readySnapshot);
+                    readySnapshot = null;
+                    return;
+                }
                 $.get(prepareDownloadSubmissionsUrl).then(
                     function (data) {
                         if (data["downloadable"]) {
-                            window.location = downloadSubmissionsUrl;
+                            downloadSubmissions(data["snapshot"]);
                             $(self).removeClass("disabled");
+                        } else if (data["empty"]) {
+                            showNoSubmissions();
                         } else {
                             $(self).addClass("disabled");
                             $(element).find('.task-message')
@@ -53,7 +69,7 @@ function Nand2TetrisXBlock(runtime, element, context) {
                                 .html(preparingSubmissionsMsg)
                                 .removeClass("ready-msg")
                                 .addClass("preparing-msg");
-                            pollSubmissionDownload();
+                            pollSubmissionDownload(data["snapshot"]);
                         }
                     }
                 ).fail(
@@ -70,8 +86,24 @@ function Nand2TetrisXBlock(runtime, element, context) {
                 );
             });
 
-            function pollSubmissionDownload() {
-                pollUntilSuccess(downloadSubmissionsStatusUrl, checkResponse, 10000, 100).then(function () {
+            function showNoSubmissions() {
+                $(element).find('#download-init-button_' + id).removeClass("disabled");
+                $(element).find('.task-message')
+                    .show()
+                    .html(noSubmissionsMsg)
+                    .removeClass("preparing-msg")
+                    .addClass("ready-msg");
+            }
+
+            function pollSubmissionDownload(snapshot) {
+                // the server holds each request until the archive is ready or ~25s pass
+                const params = {wait: 1, snapshot: snapshot};
+                pollUntilSuccess(downloadSubmissionsStatusUrl, params, checkResponse, 1000, 40).then(function (response) {
+                    if (response["empty"]) {
+                        showNoSubmissions();
+                        return;
+                    }
+                    readySnapshot = snapshot;
                     $(element).find('#download-init-button_' + id).removeClass("disabled");
                     $(element).find('.task-message')
                         .show()
@@ -141,6 +173,7 @@ function Nand2TetrisXBlock(runtime, element, context) {
                     ...table_options
                 }
                 turmas_filter.on('change', function () {
+                    readySnapshot = null;
                     const change_cohort_handlerurl = runtime.handlerUrl(element, 'change_cohort');
                     $.post(change_cohort_handlerurl, JSON.stringify({
                         'cohort': this.value
@@ -150,6 +183,26 @@ function Nand2TetrisXBlock(runtime, element, context) {
             $("#submissions_" + id).tablesorter(table_options);
         }
 
+        const gradingStatusMsgs = {
+            'received': 'Submissão recebida. A validar...',
+            'grading': 'A avaliar a submissão...',
+        };
+        let uploading = false;
+        let pollingGradingStatus = false;
+        // incremented on every upload, so polls left over from a previous upload stop
+        let uploadNumber = 0;
+
+        // the server holds each request until the grading status changes or ~5s pass
+        function pollGradingStatus(number, status) {
+            $.post(gradingStatusUrl, JSON.stringify({'status': status})).then(function (data) {
+                if (!uploading || number !== uploadNumber)
+                    return;
+                if (gradingStatusMsgs[data.status])
+                    $(element).find('#upload_' + id).text(gradingStatusMsgs[data.status]);
+                pollGradingStatus(number, data.status);
+            });
+        }
+
         // Set up file upload
         const fileUpload = $(element).find('#fileupload_' + id).fileupload({
             url: uploadUrl,
@@ -164,14 +217,23 @@ function Nand2TetrisXBlock(runtime, element, context) {
                     error('The file you are trying to upload is too large.');
                     return;
                 }
+                uploading = true;
+                pollingGradingStatus = false;
+                uploadNumber++;
                 data.submit();
             },
             progressall: function (e, data) {
                 const percent = parseInt(data.loaded / data.total * 100, 10);
                 $(element).find('#upload_' + id).text(
                     'Uploading... ' + percent + '%');
+                // only follow the grading once the file has been sent
+                if (percent >= 100 && uploading && !pollingGradingStatus) {
+                    pollingGradingStatus = true;
+                    pollGradingStatus(uploadNumber);
+                }
             },
             fail: function (e, data) {
+                uploading = false;
                 /**
                  * Nginx and other sanely implemented servers return a
                  * "413 Request entity too large" status code if an
@@ -184,6 +246,9 @@ function Nand2TetrisXBlock(runtime, element, context) {
                      * limit is.
                      */
                     error('The file you are trying to upload is too large.');
+                } else if (data.jqXHR.responseJSON && data.jqXHR.responseJSON.error) {
+                    // The submission was rejected before grading
+                    error(data.jqXHR.responseJSON.error);
                 } else {
                     // Suitably vague
                     error('There was an error uploading your file.');
@@ -196,6 +261,7 @@ function Nand2TetrisXBlock(runtime, element, context) {
                 }
             },
             done: function (e, data) {
+                uploading = false;
                 /* When you try to upload a file that exceeds Django's size
                  * limit for file uploads, Django helpfully returns a 200 OK
                  * response with a JSON payload of the form:
@@ -244,15 +310,16 @@ function Nand2TetrisXBlock(runtime, element, context) {
 
     }
     function checkResponse(response) {
-        return response["zip_available"];
+        // an empty archive is never created, stop polling too
+        return response["zip_available"] || response["empty"];
     }
 
-    function pollUntilSuccess(url, checkSuccessFn, intervalMs, maxTries) {
+    function pollUntilSuccess(url, params, checkSuccessFn, intervalMs, maxTries) {
         const deferred = $.Deferred();
         let tries = 1;
 
         function makeLoopingRequest() {
-            $.get(url).success(function (response) {
+            $.get(url, params).success(function (response) {
                 if (checkSuccessFn(response)) {
                     deferred.resolve(response);
                 } else if (tries < maxTries) {
@@ -1,24 +1,47 @@
 """celery async tasks"""
 
+import datetime
 import hashlib
 import logging
 import os
 import tempfile
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import reduce
+from operator import or_
 
+from django.conf import settings
+from django.core.cache import cache
 from django.core.files.storage import default_storage
+from django.db.models import Q
+from django.utils.text import slugify
 from celery import shared_task
+from opaque_keys.edx.keys import CourseKey, UsageKey
 from opaque_keys.edx.locator import BlockUsageLocator
-from common.djangoapps.student.models import user_by_anonymous_id
 from submissions import api as submissions_api
+from submissions.models import StudentItem, Submission
 
 ITEM_TYPE = "nand2tetrisxblock"
-from nand2tetris.utils import get_file_storage_path
+from nand2tetris.utils import (UNASSIGNED_COHORT, get_cohort_names, get_file_storage_dir,
+                               get_file_storage_path, get_result_storage_dir, get_users_by_anonymous_id,
+                               clear_notification, notify, utcnow)
 
 log = logging.getLogger(__name__)
 
+ZIP_LOCK_TIMEOUT = 30 * 60  # seconds
+# archive states published for download_submissions_status
+ARCHIVE_READY = "ready"
+ARCHIVE_EMPTY = "empty"
+STORAGE_DELETE_WORKERS = 8
+# above this many files, shared files are found with one scan instead of per-hash lookups
+REFERENCE_LOOKUP_MAX_HASHES = 200
+REFERENCE_LOOKUP_CHUNK_SIZE = 20
+ARCHIVE_MAX_AGE = datetime.timedelta(days=7)
+ARCHIVE_MAX_TOTAL_SIZE = 2 * 1000 * 1000 * 1000
+STORAGE_CLEANUP_GRACE_PERIOD = datetime.timedelta(hours=6)
 
-def _get_student_submissions(block_id, course_id, locator):
+
+def _get_student_submissions(block_id, course_id, locator, cohort=None):
     """
     Returns valid submission file paths with the username of the student that submitted them.
 
@@ -26,36 +49,49 @@ def _get_student_submissions(block_id, course_id, locator):
         course_id (unicode): edx course id
         block_id (unicode): edx block id
         locator (BlockUsageLocator): BlockUsageLocator for the sga module
+        cohort (unicode): if set, only submissions from students in this cohort are returned
 
     Returns:
-        list(tuple): A list of 2-element tuples - (student username, submission file path)
+        list(tuple): A list of 3-element tuples - (submission uuid, student username, submission file path)
     """
-    submissions = submissions_api.get_all_submissions(
-        course_id,
-        block_id,
-        ITEM_TYPE
-    )
+    submissions = [
+        submission
+        for submission in submissions_api.get_all_submissions(course_id, block_id, ITEM_TYPE)
+        if submission['answer']
+    ]
+    students = get_users_by_anonymous_id(submission['student_id'] for submission in submissions)
+    if cohort:
+        cohort_names = get_cohort_names(
+            CourseKey.from_string(course_id),
+            [student.id for student in students.values()]
+        )
+        submissions = [
+            submission
+            for submission in submissions
+            if cohort_names.get(students[submission['student_id']].id, UNASSIGNED_COHORT) == cohort
+        ]
     return [
         (
-            user_by_anonymous_id(submission['student_id']).username,
+            submission['uuid'],
+            students[submission['student_id']].username,
             get_file_storage_path(
                 locator,
                 submission['answer']['sha1'],
                 submission['answer']['filename']
             )
         )
-        for submission in submissions if submission['answer']
+        for submission in submissions
     ]
 
 
-def _compress_student_submissions(zip_file_path, block_id, course_id, locator):
+def _compress_student_submissions(zip_file_path, student_submissions):
     """
-    Creates a zip file of all student submissions for some course
+    Creates a zip file of the given student submissions
 
     Args:
-        destination_path (str): path (including name) of folder/file which we want to compress.
+        zip_file_path (str): path (including name) of the zip file to create.
+        student_submissions (list): submissions as returned by _get_student_submissions
     """
-    student_submissions = _get_student_submissions(block_id, course_id, locator)
     if not student_submissions:
         return
 
@@ -63,7 +99,7 @@ def _compress_student_submissions(zip_file_path, block_id, course_id, locator):
     # Build the zip file in memory using temporary file.
     with tempfile.TemporaryFile() as tmp:
         with zipfile.ZipFile(tmp, 'w', compression=zipfile.ZIP_DEFLATED) as zip_pointer:
-            for student_username, submission_file_path in student_submissions:
+            for _, student_username, submission_file_path in student_submissions:
                 log.info(
                     "Creating zip file for student: %s, submission path: %s ",
                     student_username,
@@ -85,28 +121,303 @@ def _compress_student_submissions(zip_file_path, block_id, course_id, locator):
 
 
 @shared_task
-def zip_student_submissions(course_id, block_id, locator_unicode, username):
+def zip_student_submissions(course_id, block_id, locator_unicode, cohort=None, snapshot=None):
     """
-    Task to download all submissions as zip file
+    Task to download all submissions as zip file. Archives are shared by all staff users and
+    named after the submissions snapshot they were requested for, so an existing archive is never
+    rebuilt. Submissions made while the task was queued are included in the archive, which keeps
+    the name staff users are waiting on.
 
     Args:
         course_id (unicode): edx course id
         block_id (unicode): edx block id
         locator_unicode (unicode): Unicode representing a BlockUsageLocator for the sga module
-        username (unicode): user name of the staff user requesting the zip file
+        cohort (unicode): if set, only submissions from students in this cohort are archived
+        snapshot (unicode): submissions snapshot the build was requested for, defaults to the current one
     """
     locator = BlockUsageLocator.from_string(locator_unicode)
-    zip_file_path = get_zip_file_path(username, course_id, block_id, locator)
-    log.info("Creating zip file for course: %s at path: %s", locator, zip_file_path)
-    if default_storage.exists(zip_file_path):
-        log.info("Deleting already-existing zip file at path: %s", zip_file_path)
-        default_storage.delete(zip_file_path)
-    _compress_student_submissions(
-        zip_file_path,
-        block_id,
-        course_id,
-        locator
+    student_submissions = _get_student_submissions(block_id, course_id, locator, cohort)
+    if snapshot is None:
+        snapshot = get_submissions_snapshot(uuid for uuid, _, _ in student_submissions)
+    zip_file_path = get_zip_file_path(course_id, block_id, locator, cohort, snapshot)
+    try:
+        if default_storage.exists(zip_file_path):
+            log.info("Zip file already exists at path: %s", zip_file_path)
+        else:
+            log.info("Creating zip file for course: %s at path: %s", locator, zip_file_path)
+            _compress_student_submissions(zip_file_path, student_submissions)
+        # wake up download_submissions_status requests waiting for this archive, no file is
+        # created when there are no submissions so waiting requests must be told to stop
+        notify(zip_file_path, ARCHIVE_READY if student_submissions else ARCHIVE_EMPTY)
+    finally:
+        release_zip_lock(zip_file_path)
+
+
+@shared_task
+def reset_course_submissions(course_id):
+    """
+    Task to clear the submissions, scores and uploaded files of every student in every
+    nand2tetris block of a course, eg when rerunning a course.
+    The blocks' student state (student_score and the published grade) lives in StudentModule,
+    which the LMS only deletes itself for per-student resets, so it is deleted here too.
+
+    Args:
+        course_id (unicode): edx course id
+    """
+    # LMS only model, this module is also imported by studio
+    from lms.djangoapps.courseware.models import StudentModule  # pylint: disable=import-outside-toplevel
+
+    student_items = list(StudentItem.objects.filter(course_id=course_id, item_type=ITEM_TYPE))
+    usage_keys = {UsageKey.from_string(student_item.item_id) for student_item in student_items}
+    submissions = Submission.objects.filter(
+        student_item__in=student_items
+    ).exclude(status=Submission.DELETED).select_related('student_item')
+    locator_submissions = [
+        (UsageKey.from_string(submission.student_item.item_id), str(submission.uuid), submission.answer)
+        for submission in submissions
+    ]
+    log.info(
+        "Resetting %d student items with %d submissions for course: %s",
+        len(student_items),
+        len(locator_submissions),
+        course_id
     )
+    # delete the state before resetting the scores, whose score_reset signal recalculates the grades
+    StudentModule.objects.filter(
+        course_id=CourseKey.from_string(course_id),
+        module_state_key__in=usage_keys
+    ).delete()
+    for student_item in student_items:
+        submissions_api.reset_score(
+            student_item.student_id,
+            course_id,
+            student_item.item_id,
+            clear_state=True
+        )
+    delete_submission_files(locator_submissions)
+
+
+def get_submission_file_paths(locator, answer):
+    """
+    Returns the storage paths of the uploaded file and grader output of a submission.
+
+    Args:
+        locator (BlockUsageLocator): BlockUsageLocator for the module
+        answer (dict): submission answer
+    """
+    paths = set()
+    if answer.get('sha1') and answer.get('filename'):
+        paths.add(get_file_storage_path(locator, answer['sha1'], answer['filename']))
+    if answer.get('result_path'):
+        paths.add(answer['result_path'])
+    return paths
+
+
+def _get_referenced_file_paths(paths=None, exclude_submission_ids=()):
+    """
+    Returns the storage paths referenced by active submissions. Paths are content addressed and
+    reruns keep block ids, so submissions of other students and course runs can share a path.
+
+    Args:
+        paths (iterable): only look for references to these paths, None for every path
+        exclude_submission_ids (iterable): uuids of submissions to ignore
+    """
+    exclude_submission_ids = set(exclude_submission_ids)
+    if paths is not None:
+        paths = set(paths)
+        if not paths:
+            return set()
+        if len(paths) > REFERENCE_LOOKUP_MAX_HASHES:
+            return _get_referenced_file_paths(None, exclude_submission_ids) & paths
+        # the file hashes are stored in the answer, only decode the submissions mentioning them
+        file_hashes = sorted({os.path.basename(path).split('.')[0] for path in paths})
+        querysets = [
+            Submission.objects.filter(
+                reduce(or_, (Q(answer__contains=file_hash) for file_hash in chunk)),
+                student_item__item_type=ITEM_TYPE
+            )
+            for chunk in (
+                file_hashes[start:start + REFERENCE_LOOKUP_CHUNK_SIZE]
+                for start in range(0, len(file_hashes), REFERENCE_LOOKUP_CHUNK_SIZE)
+            )
+        ]
+    else:
+        querysets = [Submission.objects.filter(student_item__item_type=ITEM_TYPE)]
+
+    referenced = set()
+    for submissions in querysets:
+        submissions = submissions.exclude(status=Submission.DELETED).select_related('student_item')
+        for submission in submissions.iterator():
+            if str(submission.uuid) in exclude_submission_ids:
+                continue
+            locator = UsageKey.from_string(submission.student_item.item_id)
+            referenced |= get_submission_file_paths(locator, submission.answer)
+    if paths is not None:
+        referenced &= paths
+    return referenced
+
+
+def delete_submission_files(locator_submissions):
+    """
+    Deletes the uploaded files and grader outputs of some submissions, concurrently.
+    Files still referenced by other submissions are kept.
+
+    Args:
+        locator_submissions (list(tuple)): 3-element tuples - (BlockUsageLocator, submission uuid, answer)
+    """
+    paths = set()
+    for locator, _, answer in locator_submissions:
+        paths |= get_submission_file_paths(locator, answer)
+    paths -= _get_referenced_file_paths(paths, {uuid for _, uuid, _ in locator_submissions})
+    if not paths:
+        return
+    log.info("Deleting %d submission files", len(paths))
+    with ThreadPoolExecutor(max_workers=STORAGE_DELETE_WORKERS) as executor:
+        list(executor.map(default_storage.delete, paths))
+
+
+def _list_storage_files(directory):
+    """
+    Returns the paths of the files in a storage directory, or an empty list if it does not exist.
+    """
+    try:
+        _, filenames = default_storage.listdir(directory)
+    except OSError:
+        return []
+    return [os.path.join(directory, filename) for filename in filenames]
+
+
+def _get_last_used_time(path):
+    """
+    Returns the last access time of a stored file, or its modified time if the storage does not track accesses.
+    """
+    try:
+        return default_storage.get_accessed_time(path)
+    except NotImplementedError:
+        return default_storage.get_modified_time(path)
+
+
+def _get_evictable_archives(archive_dirs, now):
+    """
+    Returns the archives older than the maximum age plus, least recently used first, the archives
+    that must go to bring the total size under the budget.
+
+    Returns:
+        list(tuple): A list of 2-element tuples - (archive path, archive size)
+    """
+    max_age = getattr(settings, "NAND2TETRIS_ARCHIVE_MAX_AGE", ARCHIVE_MAX_AGE)
+    max_total_size = getattr(settings, "NAND2TETRIS_ARCHIVE_MAX_TOTAL_SIZE", ARCHIVE_MAX_TOTAL_SIZE)
+    archives = sorted(
+        (
+            (_get_last_used_time(path), default_storage.size(path), path)
+            for directory in archive_dirs
+            for path in _list_storage_files(directory)
+        ),
+        reverse=True
+    )
+    evicted = []
+    total_size = 0
+    for last_used, size, path in archives:
+        total_size += size
+        if now - last_used < STORAGE_CLEANUP_GRACE_PERIOD:
+            # may be downloading right now
+            continue
+        if now - last_used > max_age or total_size > max_total_size:
+            evicted.append((path, size))
+            total_size -= size
+    return evicted
+
+
+def _get_orphaned_files(locators, now):
+    """
+    Returns the uploaded files and grader outputs not referenced by any active submission.
+
+    Returns:
+        list(tuple): A list of 2-element tuples - (file path, file size)
+    """
+    referenced = _get_referenced_file_paths()
+    orphaned = []
+    for directory in {get_file_storage_dir(locator) for locator in locators} | \
+            {get_result_storage_dir(locator) for locator in locators}:
+        for path in _list_storage_files(directory):
+            if path in referenced:
+                continue
+            # skip files of submissions being created
+            if now - default_storage.get_modified_time(path) < STORAGE_CLEANUP_GRACE_PERIOD:
+                continue
+            orphaned.append((path, default_storage.size(path)))
+    return orphaned
+
+
+@shared_task
+def cleanup_storage(dry_run=False):
+    """
+    Periodic task evicting old submission archives, by age and then least recently used until they fit
+    the NAND2TETRIS_ARCHIVE_MAX_TOTAL_SIZE budget, and deleting submission files no submission references.
+
+    Args:
+        dry_run (bool): only report what would be deleted
+
+    Returns:
+        dict: the deleted (or deletable) archives and submission files, and the number of bytes freed
+    """
+    now = utcnow()
+    locators = {
+        UsageKey.from_string(item_id)
+        for item_id in StudentItem.objects.filter(item_type=ITEM_TYPE).values_list('item_id', flat=True).distinct()
+    }
+    archives = _get_evictable_archives({get_zip_file_dir(locator) for locator in locators}, now)
+    orphaned_files = _get_orphaned_files(locators, now)
+    report = {
+        "archives": [path for path, _ in archives],
+        "submission_files": [path for path, _ in orphaned_files],
+        "freed_bytes": sum(size for _, size in archives + orphaned_files),
+        "dry_run": dry_run,
+    }
+    log.info(
+        "%s %d archives and %d orphaned submission files, %d bytes",
+        "Would delete" if dry_run else "Deleting",
+        len(archives),
+        len(orphaned_files),
+        report["freed_bytes"]
+    )
+    if not dry_run:
+        for path in report["archives"]:
+            clear_notification(path)
+        with ThreadPoolExecutor(max_workers=STORAGE_DELETE_WORKERS) as executor:
+            list(executor.map(default_storage.delete, report["archives"] + report["submission_files"]))
+    return report
+
+
+def get_submissions_snapshot(submission_ids):
+    """
+    Returns a fingerprint of a set of submissions, which changes whenever a submission is added or removed.
+
+    Args:
+        submission_ids (iterable): uuids of the submissions
+    """
+    sha1 = hashlib.sha1()
+    for submission_id in sorted(submission_ids):
+        sha1.update(submission_id.encode('utf-8'))
+    return sha1.hexdigest()
+
+
+def _get_zip_lock_key(zip_file_path):
+    return "nand2tetris.zip_lock.{}".format(hashlib.md5(zip_file_path.encode('utf-8')).hexdigest())
+
+
+def acquire_zip_lock(zip_file_path):
+    """
+    Returns True if the caller should build the zip file, False if a build is already in flight.
+    """
+    return cache.add(_get_zip_lock_key(zip_file_path), True, ZIP_LOCK_TIMEOUT)
+
+
+def release_zip_lock(zip_file_path):
+    """
+    Releases the build lock of a zip file.
+    """
+    cache.delete(_get_zip_lock_key(zip_file_path))
 
 
 def get_zip_file_dir(locator):
@@ -119,35 +430,38 @@ def get_zip_file_dir(locator):
     return "{loc.org}/{loc.course}/{loc.block_type}_zipped".format(loc=locator)
 
 
-def get_zip_file_name(username, course_id, block_id):
+def get_zip_file_name(course_id, block_id, cohort=None, snapshot=None):
     """
-    Returns the filename and extension of a submission zip file given a username and some
-    information about the course.
+    Returns the filename and extension of a submission zip file given some information
+    about the course and the submissions it contains.
 
     Args:
-        username (unicode): staff user name
         course_id (unicode): edx course id
         block_id (unicode): edx block id
+        cohort (unicode): cohort the archive is restricted to, if any
+        snapshot (unicode): fingerprint of the archived submissions, see get_submissions_snapshot
     """
-    return "{username}_submissions_{id}_{course_key}.zip".format(
-        username=username,
+    return "submissions_{id}{cohort}_{snapshot}_{course_key}.zip".format(
         id=hashlib.md5(block_id.encode('utf-8')).hexdigest(),
+        cohort="_" + slugify(cohort) if cohort else "",
+        snapshot=(snapshot or "")[:12],
         course_key=course_id
     )
 
 
-def get_zip_file_path(username, course_id, block_id, locator):
+def get_zip_file_path(course_id, block_id, locator, cohort=None, snapshot=None):
     """
-    Returns the relative file path of a submission zip file given a username and some
-    information about the course.
+    Returns the relative file path of a submission zip file given some information about
+    the course and the submissions it contains.
 
     Args:
-        username (unicode): user name
         course_id (unicode): edx course id
         block_id (unicode): edx block id
         locator (BlockUsageLocator): BlockUsageLocator for the sga module
+        cohort (unicode): cohort the archive is restricted to, if any
+        snapshot (unicode): fingerprint of the archived submissions, see get_submissions_snapshot
     """
     return os.path.join(
         get_zip_file_dir(locator),
-        get_zip_file_name(username, course_id, block_id)
+        get_zip_file_name(course_id, block_id, cohort, snapshot)
     )
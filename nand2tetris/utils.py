@@ -2,16 +2,57 @@
 Utility functions for the SGA XBlock
 """
 import datetime
+import gzip
 import hashlib
+import io
+import json
+import logging
 import os
+import re
 import time
+import zipfile
+import zlib
 from functools import partial
 
 import pytz
+from common.djangoapps.student.models import AnonymousUserId
 from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage
+from openedx.core.djangoapps.course_groups.models import CohortMembership
+
+log = logging.getLogger(__name__)
 
 BLOCK_SIZE = 2 ** 10 * 8  # 8kb
+NOTIFICATION_TIMEOUT = 60 * 60  # seconds
+LONG_POLL_TIMEOUT = 25  # seconds
+GRADING_POLL_TIMEOUT = 5  # seconds
+LONG_POLL_INTERVAL = 0.5  # seconds
+UNASSIGNED_COHORT = '(não atribuído)'
+
+SUBMISSION_MAX_ENTRIES = 500
+SUBMISSION_MAX_UNCOMPRESSED_SIZE = 50 * 1000 * 1000
+SUBMISSION_MAX_COMPRESSION_RATIO = 100
+
+# chips graded in each hardware project, see https://github.com/tcarreira/nand2tetris-autograder#scoring
+PROJECT_CHIPS = {
+    "01": ("not", "and", "or", "xor", "mux", "dmux", "not16", "and16", "or16", "mux16", "or8way",
+           "mux4way16", "mux8way16", "dmux4way", "dmux8way"),
+    "02": ("halfadder", "fulladder", "add16", "inc16", "alu"),
+    "03": ("bit", "register", "ram8", "ram64", "ram512", "ram4k", "ram16k", "pc"),
+    "05": ("memory", "cpu", "computer"),
+}
+
+SNAPSHOT_RE = re.compile(r'^[0-9a-f]{40}$')
+HDL_COMMENT_RE = re.compile(r'//[^\n]*|/\*.*?\*/', re.S)
+HDL_PART_RE = re.compile(r'(\w+)\s*\(')
+
+
+class InvalidSubmission(Exception):
+    """
+    Raised when an uploaded file can not possibly be graded.
+    """
 
 
 def utcnow():
@@ -45,19 +86,257 @@ def get_sha1(file_descriptor):
     return sha1.hexdigest()
 
 
+def get_file_storage_dir(locator):
+    """
+    Returns the directory where the uploaded submission files of a block are stored
+    """
+    return '{loc.org}/{loc.course}/{loc.block_type}/{loc.block_id}'.format(loc=locator)
+
+
+def get_result_storage_dir(locator):
+    """
+    Returns the directory where the grader outputs of a block are stored
+    """
+    return get_file_storage_dir(locator) + '/results'
+
+
 def get_file_storage_path(locator, file_hash, original_filename):
     """
     Returns the file path for an uploaded SGA submission file
     """
     return (
-        '{loc.org}/{loc.course}/{loc.block_type}/{loc.block_id}/{file_hash}{ext}'.format(
-            loc=locator,
+        '{dir}/{file_hash}{ext}'.format(
+            dir=get_file_storage_dir(locator),
             file_hash=file_hash,
             ext=os.path.splitext(original_filename)[1]
         )
     )
 
 
+def get_result_storage_path(locator, result_hash):
+    """
+    Returns the file path for the compressed grader output of a submission
+    """
+    return (
+        '{dir}/{result_hash}.json.gz'.format(
+            dir=get_result_storage_dir(locator),
+            result_hash=result_hash
+        )
+    )
+
+
+def save_result(locator, result):
+    """
+    Stores the grader output of a submission as a compressed blob, returns its path.
+    Identical outputs are stored only once.
+    """
+    content = json.dumps(result, sort_keys=True).encode('utf-8')
+    path = get_result_storage_path(locator, hashlib.sha1(content).hexdigest())
+    if not default_storage.exists(path):
+        default_storage.save(path, ContentFile(gzip.compress(content)))
+    return path
+
+
+def load_result(answer):
+    """
+    Returns the grader output of a submission answer.
+    """
+    if 'result' in answer:
+        # submissions graded before results were moved to storage
+        return json.loads(answer['result'])
+    try:
+        with default_storage.open(answer['result_path'], 'rb') as result_file:
+            return json.loads(gzip.decompress(result_file.read()).decode('utf-8'))
+    except OSError:
+        log.warning("Grader output not found at path: %s", answer['result_path'])
+        return {"output": [], "stderr": ""}
+
+
+def get_users_by_anonymous_id(anonymous_ids):
+    """
+    Returns a dict mapping anonymous student ids to users, resolved with a single query
+    """
+    return {
+        anonymous_user.anonymous_user_id: anonymous_user.user
+        for anonymous_user in AnonymousUserId.objects.filter(
+            anonymous_user_id__in=set(anonymous_ids)
+        ).select_related('user', 'user__profile')
+    }
+
+
+def get_cohort_names(course_key, user_ids):
+    """
+    Returns a dict mapping user ids to the name of their cohort in the course, resolved with a single query.
+    Users without a cohort are not included.
+    """
+    memberships = CohortMembership.objects.filter(
+        course_id=course_key,
+        user_id__in=set(user_ids)
+    ).select_related('course_user_group')
+    return {
+        membership.user_id: membership.course_user_group.name
+        for membership in memberships
+    }
+
+
+def validate_submission_zip(file_descriptor, expected_chips=()):
+    """
+    Cheap sanity checks on an uploaded zip file, based only on its central directory.
+    Raises InvalidSubmission if the file is not a zip, looks like a zip bomb or contains
+    none of the expected chips (lowercase names, without extension).
+    """
+    file_descriptor.seek(0)
+    try:
+        with zipfile.ZipFile(file_descriptor) as archive:
+            entries = [entry for entry in archive.infolist() if not entry.is_dir()]
+    except (zipfile.BadZipFile, zipfile.LargeZipFile, EOFError):
+        raise InvalidSubmission('O ficheiro submetido não é um ficheiro zip válido.')
+    finally:
+        file_descriptor.seek(0)
+
+    if len(entries) > SUBMISSION_MAX_ENTRIES:
+        raise InvalidSubmission(
+            'O ficheiro zip tem demasiados ficheiros (máximo {}).'.format(SUBMISSION_MAX_ENTRIES)
+        )
+    uncompressed_size = sum(entry.file_size for entry in entries)
+    compressed_size = sum(entry.compress_size for entry in entries)
+    if uncompressed_size > SUBMISSION_MAX_UNCOMPRESSED_SIZE or \
+            uncompressed_size > SUBMISSION_MAX_COMPRESSION_RATIO * max(compressed_size, 1):
+        raise InvalidSubmission('O conteúdo do ficheiro zip é demasiado grande.')
+
+    if expected_chips:
+        submitted_chips = {
+            os.path.splitext(os.path.basename(entry.filename))[0].lower()
+            for entry in entries
+            if entry.filename.lower().endswith('.hdl')
+        }
+        if not submitted_chips:
+            raise InvalidSubmission('O ficheiro zip não contém nenhum ficheiro .hdl.')
+        if submitted_chips.isdisjoint(expected_chips):
+            raise InvalidSubmission(
+                'O ficheiro zip não contém nenhum dos chips deste projeto ({}).'.format(
+                    ', '.join(chip + '.hdl' for chip in expected_chips)
+                )
+            )
+
+
+def _get_hdl_sources(archive):
+    """
+    Returns a dict mapping each chip (lowercase name) in a zip archive to its zip entry.
+    """
+    return {
+        os.path.splitext(os.path.basename(entry.filename))[0].lower(): entry
+        for entry in archive.infolist()
+        if not entry.is_dir() and entry.filename.lower().endswith('.hdl')
+    }
+
+
+def _get_hdl_parts(source):
+    """
+    Returns the names (lowercase) of the chips used in the PARTS section of an hdl file.
+    """
+    source = HDL_COMMENT_RE.sub('', source.decode('utf-8', 'replace'))
+    _, _, parts = source.partition('PARTS:')
+    return {part.lower() for part in HDL_PART_RE.findall(parts)}
+
+
+def get_hdl_chip_hashes(file_content):
+    """
+    Returns a dict mapping each chip (lowercase name) in a zip file to a hash of its hdl file
+    and of the hdl files of the submitted chips it uses, directly or not.
+    Raises InvalidSubmission if the hdl files can not be read.
+    """
+    try:
+        with zipfile.ZipFile(io.BytesIO(file_content)) as archive:
+            sources = {chip: archive.read(entry) for chip, entry in _get_hdl_sources(archive).items()}
+    except (zipfile.BadZipFile, zlib.error, EOFError):
+        raise InvalidSubmission('O ficheiro zip está corrompido.')
+    dependencies = get_hdl_dependencies(sources)
+    chip_hashes = {}
+    for chip in sources:
+        sha1 = hashlib.sha1()
+        for dependency in sorted(dependencies[chip]):
+            sha1.update(dependency.encode('utf-8'))
+            sha1.update(sources[dependency])
+        chip_hashes[chip] = sha1.hexdigest()
+    return chip_hashes
+
+
+def get_hdl_dependencies(sources):
+    """
+    Returns a dict mapping each chip to the set of submitted chips it uses, directly or not, including itself.
+
+    Args:
+        sources (dict): chip name (lowercase) to hdl file contents
+    """
+    parts = {chip: _get_hdl_parts(source) & set(sources) for chip, source in sources.items()}
+    dependencies = {}
+    for chip in sources:
+        seen = {chip}
+        pending = [chip]
+        while pending:
+            for part in parts[pending.pop()] - seen:
+                seen.add(part)
+                pending.append(part)
+        dependencies[chip] = seen
+    return dependencies
+
+
+def build_partial_zip(file_content, chips):
+    """
+    Returns a copy of a zip file containing only the hdl files of the given chips and of the chips they use.
+    Raises InvalidSubmission if the hdl files can not be read.
+    """
+    partial_zip = io.BytesIO()
+    try:
+        with zipfile.ZipFile(io.BytesIO(file_content)) as archive:
+            entries = _get_hdl_sources(archive)
+            sources = {chip: archive.read(entry) for chip, entry in entries.items()}
+    except (zipfile.BadZipFile, zlib.error, EOFError):
+        raise InvalidSubmission('O ficheiro zip está corrompido.')
+    dependencies = get_hdl_dependencies(sources)
+    included = set()
+    for chip in chips:
+        included |= dependencies.get(chip, set())
+    with zipfile.ZipFile(partial_zip, 'w', compression=zipfile.ZIP_DEFLATED) as partial_archive:
+        for chip in included:
+            partial_archive.writestr(entries[chip], sources[chip])
+    return partial_zip.getvalue()
+
+
+def _get_notification_key(name):
+    return "nand2tetris.notification.{}".format(hashlib.md5(name.encode('utf-8')).hexdigest())
+
+
+def notify(name, value):
+    """
+    Publishes a value for long-polling handlers waiting on a notification name (eg a file path).
+    """
+    cache.set(_get_notification_key(name), value, NOTIFICATION_TIMEOUT)
+
+
+def clear_notification(name):
+    """
+    Removes the value published for a notification name.
+    """
+    cache.delete(_get_notification_key(name))
+
+
+def wait_for_notification(name, previous=None, timeout=LONG_POLL_TIMEOUT):
+    """
+    Waits until the value published for a notification name differs from previous, or the timeout expires.
+    Returns the latest value, None if nothing was published.
+    Only the cache is polled, so waiting is cheap compared to checking storage.
+    """
+    key = _get_notification_key(name)
+    deadline = time.time() + timeout
+    value = cache.get(key)
+    while value == previous and time.time() < deadline:
+        time.sleep(LONG_POLL_INTERVAL)
+        value = cache.get(key)
+    return value
+
+
 def file_contents_iter(file_path):
     """
     Returns an iterator over the contents of a file located at the given file path
@@ -26,9 +26,11 @@ setup(
     description='xblock to evaluate students nand2tetris submissions',
     packages=[
         'nand2tetris',
+        'nand2tetris.management',
+        'nand2tetris.management.commands',
     ],
     install_requires=[
-        'XBlock', 'epicbox', 'xblock-utils', 'edx-submissions'
+        'XBlock', 'epicbox', 'xblock-utils', 'edx-submissions', 'requests'
     ],
     dependency_links=[
         'git+https://github.com/StepicOrg/epicbox.git',